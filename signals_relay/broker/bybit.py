@@ -1,23 +1,52 @@
 # signals_relay/broker/bybit.py
 import asyncio
-import hashlib
 import hmac
-import json
 import logging
+import sqlite3
 import time
-from typing import Any, Dict, Optional, Tuple
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Any, Dict, Optional, Tuple, Union
 
-import httpx
+import aiohttp
 
 from signals_relay.config import cfg
 
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:  # fallback на stdlib, если orjson не установлен
+    import json
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    _loads = json.loads
+
 log = logging.getLogger(__name__)
 
 JSON = Dict[str, Any]
+Number = Union[Decimal, float]
+
+_TIME_SYNC_SAMPLES = 4
+_ACCOUNT_PREP_TTL_SEC = 3600.0  # сколько доверяем тому, что плечо/режим маржи уже выставлены
+_LEVERAGE_NOT_MODIFIED = 110043  # плечо уже такое — для нас это успех
+_MARGIN_NOT_MODIFIED = 110026    # режим маржи уже такой
+_PRECISION_ERRORS = frozenset({170134, 170137})  # цена / qty с лишними знаками — шаги инструмента устарели
+
+
+class BybitAPIError(RuntimeError):
+    """Ошибка Bybit с retCode != 0; код доступен в .code."""
+
+    def __init__(self, msg: str, code: Any) -> None:
+        super().__init__(f"{msg} (ErrCode: {code})")
+        self.code = code
 
 
-def _now_ms() -> int:
-    return int(time.time() * 1000)
+def _fmt(v: Number) -> str:
+    # Decimal → фиксированная запись (str() дал бы '1E-7' для мелких шагов)
+    return format(v, "f") if isinstance(v, Decimal) else str(v)
 
 
 class BybitBroker:
@@ -29,7 +58,7 @@ class BybitBroker:
     - кэш шагов инструмента
     """
 
-    def __init__(self) -> None:
+    def __init__(self, *, session: Optional[aiohttp.ClientSession] = None) -> None:
         self.api_key = cfg.BYBIT_API_KEY
         self.api_secret = cfg.BYBIT_API_SECRET.encode()
         self.category = cfg.BYBIT_CATEGORY
@@ -37,16 +66,25 @@ class BybitBroker:
         self.max_retries = cfg.BYBIT_MAX_RETRIES
         self.time_resync_sec = cfg.BYBIT_TIME_RESYNC_SEC
 
-        self.base_url = "https://api-testnet.bybit.com" if cfg.BYBIT_TESTNET else "https://api.bybit.com"
-        self._client = httpx.AsyncClient(
-            base_url=self.base_url,
-            timeout=httpx.Timeout(cfg.BYBIT_TIMEOUT_SEC, connect=cfg.BYBIT_TIMEOUT_SEC),
-            headers={"Content-Type": "application/json"},
-        )
+        # неизменная часть строки подписи: ts + api_key + recv_window + payload
+        self._sig_tail = f"{self.api_key}{self.recv_window_ms}".encode()
+        self._recv_str = str(self.recv_window_ms)
 
-        self._time_offset_ms: int = 0
-        self._last_sync_ts: float = 0.0
-        self._instruments: Dict[str, Tuple[float, float]] = {}  # symbol -> (tickSize, qtyStep)
+        self.base_url = "https://api-testnet.bybit.com" if cfg.BYBIT_TESTNET else "https://api.bybit.com"
+        # общая сессия процесса (если передали) или своя, создаётся лениво внутри event loop
+        self._client: Optional[aiohttp.ClientSession] = session
+        self._owns_client = session is None
+        self._timeout = aiohttp.ClientTimeout(total=cfg.BYBIT_TIMEOUT_SEC)
+
+        # серверное время = monotonic_ns + offset; до первой синхронизации — локальные стенные часы
+        self._wall_offset_ns: int = time.time_ns() - time.monotonic_ns()
+        self._last_sync_ns: Optional[int] = None
+        self._sync_lock = asyncio.Lock()  # одновременные запросы делят один ресинк
+        self._instruments: Dict[str, Tuple[Decimal, Decimal]] = {}  # symbol -> (tickSize, qtyStep)
+        self._lev_set: Dict[str, Tuple[int, float]] = {}  # symbol -> (leverage, monotonic ts)
+        self._iso_set: Dict[str, float] = {}                # symbol -> monotonic ts
+        self._net = "testnet" if cfg.BYBIT_TESTNET else "live"
+        self._inst_db = self._open_inst_cache(cfg.BYBIT_INSTRUMENTS_CACHE, cfg.BYBIT_INSTRUMENTS_TTL_SEC)
 
         log.info(
             "Broker=Bybit v5 ready [%s, category=%s]",
@@ -54,57 +92,105 @@ class BybitBroker:
             self.category,
         )
 
+    # ---------- http session ----------
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self._owns_client and (self._client is None or self._client.closed):
+            self._client = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, limit_per_host=16, keepalive_timeout=75),
+            )
+        return self._client
+
     # ---------- time sync ----------
 
-    async def _sync_time(self) -> None:
-        try:
-            r = await self._client.get("/v5/market/time")
+    def _now_ms(self) -> int:
+        return (time.monotonic_ns() + self._wall_offset_ns) // 1_000_000
+
+    async def _time_sample(self) -> Tuple[int, int]:
+        """Один замер /v5/market/time → (offset_ns, rtt_ns)."""
+        t0 = time.monotonic_ns()
+        async with self._session().get(self.base_url + "/v5/market/time", timeout=self._timeout) as r:
             r.raise_for_status()
-            data = r.json()
-            server_ms: Optional[int] = None
-            if isinstance(data, dict):
-                if "time" in data and isinstance(data["time"], (int, float)):
-                    server_ms = int(data["time"])
-                elif "result" in data and isinstance(data["result"], dict):
-                    res = data["result"]
-                    if "timeNano" in res:
-                        server_ms = int(int(res["timeNano"]) / 1_000_000)
-                    elif "timeSecond" in res:
-                        server_ms = int(res["timeSecond"]) * 1000
-            if not server_ms:
-                raise RuntimeError(f"Unexpected time payload: {data}")
-
-            local_ms = _now_ms()
-            self._time_offset_ms = server_ms - local_ms
-            self._last_sync_ts = time.time()
-            log.info("Bybit time sync: offset=%s ms", self._time_offset_ms)
-        except Exception as e:
-            log.warning("Bybit: time sync failed: %s", e)
+            data = _loads(await r.read())
+        t1 = time.monotonic_ns()
+        server_ns: Optional[int] = None
+        if isinstance(data, dict):
+            if "time" in data and isinstance(data["time"], (int, float)):
+                server_ns = int(data["time"]) * 1_000_000
+            elif "result" in data and isinstance(data["result"], dict):
+                res = data["result"]
+                if "timeNano" in res:
+                    server_ns = int(res["timeNano"])
+                elif "timeSecond" in res:
+                    server_ns = int(res["timeSecond"]) * 1_000_000_000
+        if not server_ns:
+            raise RuntimeError(f"Unexpected time payload: {data}")
+        # серверное время относим к середине запроса (половина RTT)
+        return server_ns - (t0 + t1) // 2, t1 - t0
+
+    async def _sync_time(self, *, force: bool = False) -> None:
+        requested_ns = time.monotonic_ns()
+        async with self._sync_lock:
+            # пока ждали lock, синхронизацию уже мог выполнить другой запрос
+            if self._last_sync_ns is not None and self._last_sync_ns >= requested_ns:
+                return
+            if not force and not self._need_resync():
+                return
+
+            # замеры строго последовательно: параллельные на холодном пуле открыли бы по своему
+            # соединению, и каждый RTT включал бы TCP/TLS-рукопожатие — минимум по RTT ничего бы
+            # не отсеял. Первый замер прогревает соединение, следующие идут по нему же.
+            samples = []
+            last_error: Optional[Exception] = None
+            for _ in range(_TIME_SYNC_SAMPLES):
+                try:
+                    samples.append(await self._time_sample())
+                except Exception as e:
+                    last_error = e
+                    break  # эндпоинт недоступен — не ждём таймаут на каждом оставшемся замере
+            # отмечаем попытку и при неудаче: недоступный /v5/market/time не должен тормозить каждый запрос
+            self._last_sync_ns = time.monotonic_ns()
+            if not samples:
+                log.warning("Bybit: time sync failed: %s", last_error)
+                return
+
+            offset_ns, rtt_ns = min(samples, key=lambda s: s[1])
+            self._wall_offset_ns = offset_ns
+            log.info(
+                "Bybit time sync: offset=%s ms rtt=%s ms (%s/%s samples)",
+                (offset_ns - (time.time_ns() - time.monotonic_ns())) // 1_000_000,
+                rtt_ns // 1_000_000,
+                len(samples),
+                _TIME_SYNC_SAMPLES,
+            )
 
     def _need_resync(self) -> bool:
-        return (time.time() - self._last_sync_ts) > self.time_resync_sec
+        if self._last_sync_ns is None:
+            return True
+        return (time.monotonic_ns() - self._last_sync_ns) > self.time_resync_sec * 1_000_000_000
 
     # ---------- signing ----------
 
-    def _signed_headers(self, method: str, query: Optional[JSON], body: Optional[JSON]) -> Dict[str, str]:
-        ts = _now_ms() + self._time_offset_ms
-        recv = self.recv_window_ms
-
-        if method.upper() == "GET":
-            payload = ""
-            if query:
-                items = sorted((k, str(v)) for k, v in query.items() if v is not None)
-                payload = "&".join(f"{k}={v}" for k, v in items)
-        else:
-            payload = json.dumps(body or {}, separators=(",", ":"))
-
-        sign_str = f"{ts}{self.api_key}{recv}{payload}"
-        sign = hmac.new(self.api_secret, sign_str.encode(), hashlib.sha256).hexdigest()
+    @staticmethod
+    def _canon_payload(method: str, query: Optional[JSON], body: Optional[JSON]) -> bytes:
+        """Строка, которая подписывается: query-string для GET, компактный JSON-body для POST."""
+        if method == "GET":
+            if not query:
+                return b""
+            items = sorted((k, str(v)) for k, v in query.items() if v is not None)
+            return "&".join(f"{k}={v}" for k, v in items).encode()
+        return _dumps(body or {})
+
+    def _sign_payload(self, payload: bytes, ts: int) -> str:
+        return hmac.digest(self.api_secret, str(ts).encode() + self._sig_tail + payload, "sha256").hex()
+
+    def _signed_headers(self, payload: bytes) -> Dict[str, str]:
+        ts = self._now_ms()
         return {
             "X-BAPI-API-KEY": self.api_key,
-            "X-BAPI-SIGN": sign,
+            "X-BAPI-SIGN": self._sign_payload(payload, ts),
             "X-BAPI-TIMESTAMP": str(ts),
-            "X-BAPI-RECV-WINDOW": str(recv),
+            "X-BAPI-RECV-WINDOW": self._recv_str,
             "X-BAPI-SIGN-TYPE": "2",
             "Content-Type": "application/json",
         }
@@ -125,39 +211,107 @@ class BybitBroker:
         if self._need_resync():
             await self._sync_time()
 
+        # payload считаем один раз: на ретраях меняется только timestamp/подпись,
+        # а POST отправляет ровно те байты, что были подписаны
+        method = method.upper()
+        payload = self._canon_payload(method, query, body)
+        url = self.base_url + path
+
         while True:
             tries += 1
-            headers = self._signed_headers(method, query, body) if auth else None
+            headers = self._signed_headers(payload) if auth else None
             try:
-                if method.upper() == "GET":
-                    resp = await self._client.get(path, params=query, headers=headers)
+                session = self._session()
+                if method == "GET":
+                    async with session.get(url, params=query, headers=headers, timeout=self._timeout) as resp:
+                        j = _loads(await resp.read())
                 else:
-                    resp = await self._client.post(path, params=query, json=body, headers=headers)
-                j = resp.json()
+                    async with session.post(
+                        url, params=query, data=payload, headers=headers, timeout=self._timeout
+                    ) as resp:
+                        j = _loads(await resp.read())
                 ret = j.get("retCode")
                 if ret == 0:
                     return j.get("result") or {}
                 if ret in (10002, 10003):
                     log.error("Timestamp window on %s → resync & retry (%s: %s)", opname or path, ret, j.get("retMsg"))
-                    await self._sync_time()
+                    await self._sync_time(force=True)
                     if tries <= self.max_retries:
                         await asyncio.sleep(0.5 * tries)
                         continue
-                raise RuntimeError(f"{j.get('retMsg','Bybit error')} (ErrCode: {ret})")
-            except httpx.HTTPError as e:
+                raise BybitAPIError(j.get("retMsg", "Bybit error"), ret)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 if tries <= self.max_retries:
                     await asyncio.sleep(0.5 * tries)
                     continue
                 raise RuntimeError(f"HTTP error {opname or path}: {e}") from e
 
     async def aclose(self) -> None:
-        await self._client.aclose()
+        if self._owns_client and self._client is not None:
+            await self._client.close()
+            self._client = None
+        if self._inst_db is not None:
+            self._inst_db.close()
+            self._inst_db = None
+
+    # ---------- instruments disk cache ----------
+
+    def _open_inst_cache(self, path: str, ttl_sec: int) -> Optional[sqlite3.Connection]:
+        """Открывает SQLite-кэш шагов инструментов и подгружает свежие записи в память."""
+        if not path:
+            return None
+        try:
+            db = sqlite3.connect(path, isolation_level=None)
+            # пишем прямо из event loop на пути ордера: fsync на каждый INSERT там недопустим.
+            # Кэш одноразовый — потерянная при сбое запись просто перечитается с биржи.
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS inst("
+                "net TEXT, category TEXT, sym TEXT, tick TEXT, lot TEXT, ts REAL, "
+                "PRIMARY KEY (net, category, sym))"
+            )
+            rows = db.execute(
+                "SELECT sym, tick, lot FROM inst WHERE net=? AND category=? AND ts>?",
+                (self._net, self.category, time.time() - ttl_sec),
+            ).fetchall()
+        except sqlite3.Error as e:
+            log.warning("Bybit: instruments cache disabled (%s): %s", path, e)
+            return None
+        for sym, tick, lot in rows:
+            self._instruments[sym] = (Decimal(tick), Decimal(lot))
+        log.info("Bybit: %s instruments loaded from cache %s", len(rows), path)
+        return db
+
+    def _store_instrument(self, symbol: str, tick: str, lot: str) -> None:
+        if self._inst_db is None:
+            return
+        try:
+            self._inst_db.execute(
+                "INSERT OR REPLACE INTO inst(net, category, sym, tick, lot, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                (self._net, self.category, symbol, tick, lot, time.time()),
+            )
+        except sqlite3.Error as e:
+            log.warning("Bybit: instruments cache write failed: %s", e)
+
+    def _forget_instrument(self, symbol: str) -> None:
+        """Сбрасывает шаги символа из памяти и с диска — при следующем ордере перечитаем с биржи."""
+        self._instruments.pop(symbol, None)
+        if self._inst_db is None:
+            return
+        try:
+            self._inst_db.execute(
+                "DELETE FROM inst WHERE net=? AND category=? AND sym=?", (self._net, self.category, symbol)
+            )
+        except sqlite3.Error as e:
+            log.warning("Bybit: instruments cache delete failed: %s", e)
 
     # ---------- market meta ----------
 
-    async def _instrument_info(self, symbol: str) -> Tuple[float, float]:
-        if symbol in self._instruments:
-            return self._instruments[symbol]
+    async def instrument_info(self, symbol: str) -> Tuple[Decimal, Decimal]:
+        steps = self._instruments.get(symbol)
+        if steps is not None:
+            return steps
         res = await self._request(
             "GET",
             "/v5/market/instruments-info",
@@ -169,45 +323,71 @@ class BybitBroker:
         if not rows:
             raise RuntimeError(f"No instrument info for {symbol}")
         row = rows[0]
-        tick = float(row.get("priceFilter", {}).get("tickSize", "0.0001"))
-        lot = float(row.get("lotSizeFilter", {}).get("qtyStep", "0.001"))
+        tick_s = str(row.get("priceFilter", {}).get("tickSize", "0.0001"))
+        lot_s = str(row.get("lotSizeFilter", {}).get("qtyStep", "0.001"))
+        tick, lot = Decimal(tick_s), Decimal(lot_s)
         self._instruments[symbol] = (tick, lot)
+        self._store_instrument(symbol, tick_s, lot_s)
         return tick, lot
 
     @staticmethod
-    def _quantize(val: float, step: float) -> float:
-        return round((round(val / step) * step), 10)
+    def _quantize(val: Number, step: Decimal) -> Decimal:
+        # считаем в Decimal от строкового шага биржи — без хвостов вида 0.30000000000000004
+        return (Decimal(str(val)) / step).quantize(Decimal(1), rounding=ROUND_HALF_EVEN) * step
+
+    @classmethod
+    def quantize_with(
+        cls, steps: Tuple[Decimal, Decimal], price: Optional[Number], qty: Number
+    ) -> Tuple[Optional[Decimal], Decimal]:
+        """Синхронное округление по уже известным (tickSize, qtyStep) — без обращения к сети."""
+        tick, lot = steps
+        q_price = cls._quantize(price, tick) if price is not None else None
+        q_qty = max(cls._quantize(qty, lot), lot)
+        return q_price, q_qty
 
     async def quantize_price_qty(
-        self, symbol: str, price: Optional[float], qty: float
-    ) -> Tuple[Optional[float], float]:
-        tick, lot = await self._instrument_info(symbol)
-        q_price = self._quantize(price, tick) if price is not None else None
-        q_qty = max(self._quantize(qty, lot), lot)
-        return q_price, q_qty
+        self, symbol: str, price: Optional[Number], qty: Number
+    ) -> Tuple[Optional[Decimal], Decimal]:
+        return self.quantize_with(await self.instrument_info(symbol), price, qty)
 
     # ---------- account prep ----------
 
     async def set_leverage(self, symbol: str, leverage: int) -> None:
-        await self._request(
-            "POST",
-            "/v5/position/set-leverage",
-            body={
-                "category": self.category,
-                "symbol": symbol,
-                "buyLeverage": str(leverage),
-                "sellLeverage": str(leverage),
-            },
-            opname="set_leverage",
-        )
+        prev = self._lev_set.get(symbol)
+        if prev and prev[0] == leverage and time.monotonic() - prev[1] < _ACCOUNT_PREP_TTL_SEC:
+            return
+        try:
+            await self._request(
+                "POST",
+                "/v5/position/set-leverage",
+                body={
+                    "category": self.category,
+                    "symbol": symbol,
+                    "buyLeverage": str(leverage),
+                    "sellLeverage": str(leverage),
+                },
+                opname="set_leverage",
+            )
+        except BybitAPIError as e:
+            if e.code != _LEVERAGE_NOT_MODIFIED:
+                raise
+        self._lev_set[symbol] = (leverage, time.monotonic())
 
     async def switch_isolated(self, symbol: str) -> None:
-        await self._request(
-            "POST",
-            "/v5/position/switch-isolated",
-            body={"category": self.category, "symbol": symbol, "tradeMode": 1},
-            opname="switch_isolated",
-        )
+        ts = self._iso_set.get(symbol)
+        if ts is not None and time.monotonic() - ts < _ACCOUNT_PREP_TTL_SEC:
+            return
+        try:
+            await self._request(
+                "POST",
+                "/v5/position/switch-isolated",
+                body={"category": self.category, "symbol": symbol, "tradeMode": 1},
+                opname="switch_isolated",
+            )
+        except BybitAPIError as e:
+            if e.code != _MARGIN_NOT_MODIFIED:
+                raise
+        self._iso_set[symbol] = time.monotonic()
 
     # ---------- trading ----------
 
@@ -217,10 +397,10 @@ class BybitBroker:
         symbol: str,
         side: str,           # "Buy" / "Sell"
         order_type: str,     # "Limit" / "Market"
-        qty: float,
-        price: Optional[float] = None,
-        take_profit: Optional[float] = None,
-        stop_loss: Optional[float] = None,
+        qty: Number,
+        price: Optional[Number] = None,
+        take_profit: Optional[Number] = None,
+        stop_loss: Optional[Number] = None,
         time_in_force: str = "GTC",
         reduce_only: bool = False,
         tpsl_mode: str = "Full",
@@ -231,18 +411,24 @@ class BybitBroker:
             "symbol": symbol,
             "side": side,
             "orderType": order_type,
-            "qty": str(qty),
+            "qty": _fmt(qty),
             "timeInForce": time_in_force,
             "reduceOnly": reduce_only,
             "tpslMode": tpsl_mode,
         }
         if price is not None:
-            body["price"] = str(price)
+            body["price"] = _fmt(price)
         if take_profit is not None:
-            body["takeProfit"] = str(take_profit)
+            body["takeProfit"] = _fmt(take_profit)
             body["tpTriggerBy"] = trigger_by
         if stop_loss is not None:
-            body["stopLoss"] = str(stop_loss)
+            body["stopLoss"] = _fmt(stop_loss)
             body["slTriggerBy"] = trigger_by
 
-        return await self._request("POST", "/v5/order/create", body=body, opname="place_order")
+        try:
+            return await self._request("POST", "/v5/order/create", body=body, opname="place_order")
+        except BybitAPIError as e:
+            if e.code in _PRECISION_ERRORS:
+                log.warning("Bybit: %s steps rejected by exchange, dropping cached instrument info", symbol)
+                self._forget_instrument(symbol)
+            raise
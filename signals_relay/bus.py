@@ -2,6 +2,8 @@
 import asyncio
 import contextlib
 import logging
+import time
+from collections import OrderedDict
 from typing import Optional
 
 from signals_relay.config import cfg
@@ -10,6 +12,9 @@ from signals_relay.broker.bybit import BybitBroker
 
 log = logging.getLogger(__name__)
 
+_SEEN_MAX = 2048           # сколько последних сигналов помним для отсева дублей
+_DEDUP_WINDOW_SEC = 300.0  # повтор того же сетапа позже окна — уже новый сигнал
+
 
 class TradingBus:
     """
@@ -25,9 +30,11 @@ class TradingBus:
         default_leverage: int | None = None,
         market_entry: bool | None = None,
         max_concurrent: int = 1,
+        max_queue: int = 256,
     ) -> None:
         self.broker = broker
-        self.q: asyncio.Queue[TradeSignal] = asyncio.Queue()
+        # ограниченная очередь: при перегрузе вытесняем самый старый (уже протухший) сигнал
+        self.q: asyncio.Queue[TradeSignal] = asyncio.Queue(maxsize=max_queue)
         self.sem = asyncio.Semaphore(max_concurrent)
 
         self.usdt_per_trade = usdt_per_trade if usdt_per_trade is not None else cfg.RISK_USDT_PER_TRADE
@@ -35,6 +42,7 @@ class TradingBus:
         self.market_entry = market_entry if market_entry is not None else cfg.ORDER_MARKET_ENTRY
 
         self._task: Optional[asyncio.Task] = None
+        self._seen: OrderedDict[tuple, float] = OrderedDict()  # key -> monotonic ts
 
     async def start(self) -> None:
         if self._task is None:
@@ -47,13 +55,34 @@ class TradingBus:
                 await self._task
             self._task = None
 
-    async def enqueue(self, s: TradeSignal) -> None:
-        await self.q.put(s)
+    async def enqueue(self, s: TradeSignal) -> bool:
+        """Ставит сигнал в очередь; False — дубль, отброшен."""
+        # повторная доставка того же поста в течение короткого окна не должна давать второй ордер
+        now = time.monotonic()
+        seen = self._seen
+        while seen and now - next(iter(seen.values())) >= _DEDUP_WINDOW_SEC:
+            seen.popitem(last=False)
+        key = (s.symbol, s.side, s.entry, s.stop, s.take, s.leverage)
+        if key in seen:
+            log.warning("[BUS] duplicate signal skipped: %s %s entry=%s", s.symbol, s.side.name, s.entry)
+            return False
+        seen[key] = now
+        if len(seen) > _SEEN_MAX:
+            seen.popitem(last=False)
+
+        try:
+            self.q.put_nowait(s)
+        except asyncio.QueueFull:
+            stale = self.q.get_nowait()
+            self.q.task_done()
+            log.warning("[BUS] queue full, dropped stale signal: %s %s", stale.symbol, stale.side.name)
+            self.q.put_nowait(s)
         log.info("[BUS] enqueued")
         log.info(
             "[BUS] %s %s entry=%s stop=%s take=%s lev=%s",
             s.symbol, s.side.name, s.entry, s.stop, s.take, s.leverage or "x?",
         )
+        return True
 
     async def _worker(self) -> None:
         while True:
@@ -74,27 +103,21 @@ class TradingBus:
             side = "Sell" if s.is_short else "Buy"
             order_type = "Market" if self.market_entry else "Limit"
 
-            # подготовка аккаунта (best-effort)
-            try:
-                await self.broker.set_leverage(symbol, lev)
-            except Exception as e:
-                log.warning("Bybit: set_leverage failed: %s", e)
-
-            if cfg.BYBIT_SWITCH_ISOLATED:
-                try:
-                    await self.broker.switch_isolated(symbol)
-                except Exception as e:
-                    log.warning("Bybit: switch_isolated failed: %s", e)
-
             # капитал → количество
-            qty = await self._calc_qty(symbol, s.entry, lev)
+            qty = self.usdt_per_trade * lev / max(s.entry, 1e-9)
 
-            # округления под шаги инструмента
-            price_q, qty_q = await self.broker.quantize_price_qty(
-                symbol, (None if order_type == "Market" else s.entry), qty
+            # шаги инструмента и подготовка аккаунта независимы — выполняем параллельно
+            steps, _ = await asyncio.gather(
+                self.broker.instrument_info(symbol),
+                self._prepare_account(symbol, lev),
             )
-            tp_q, _ = await self.broker.quantize_price_qty(symbol, s.take, qty_q)
-            sl_q, _ = await self.broker.quantize_price_qty(symbol, s.stop, qty_q)
+
+            # округления под шаги инструмента (без сети)
+            price_q, qty_q = self.broker.quantize_with(
+                steps, (None if order_type == "Market" else s.entry), qty
+            )
+            tp_q, _ = self.broker.quantize_with(steps, s.take, qty_q)
+            sl_q, _ = self.broker.quantize_with(steps, s.stop, qty_q)
 
             log.info(
                 "[BROKER] Bybit %s %s qty=%s price=%s sl=%s tp=%s lev=x%s tif=%s market_entry=%s",
@@ -125,6 +148,15 @@ class TradingBus:
             order_id = (res or {}).get("orderId")
             log.info("[BUS] order accepted: %s", order_id)
 
-    async def _calc_qty(self, symbol: str, entry: float, leverage: int) -> float:
-        nominal = self.usdt_per_trade * leverage
-        return nominal / max(entry, 1e-9)
+    async def _prepare_account(self, symbol: str, lev: int) -> None:
+        # подготовка аккаунта (best-effort)
+        try:
+            await self.broker.set_leverage(symbol, lev)
+        except Exception as e:
+            log.warning("Bybit: set_leverage failed: %s", e)
+
+        if cfg.BYBIT_SWITCH_ISOLATED:
+            try:
+                await self.broker.switch_isolated(symbol)
+            except Exception as e:
+                log.warning("Bybit: switch_isolated failed: %s", e)
@@ -32,7 +32,8 @@ class Config:
     BOT_TOKEN: str
     SOURCE_ID: int
     DEST_ID: int
-    TELEGRAM_POLL_INTERVAL: float
+    TELEGRAM_POLL_INTERVAL: float   # пауза между getUpdates; с long polling обычно 0
+    TELEGRAM_POLL_TIMEOUT: int      # long polling: сколько секунд Telegram держит getUpdates
     TELEGRAM_DROP_PENDING: bool
 
     # --- Logging ---
@@ -57,6 +58,8 @@ class Config:
     BYBIT_TIME_RESYNC_SEC: int
     BYBIT_SWITCH_ISOLATED: bool
     BYBIT_TIMEOUT_SEC: float        # <— ДОБАВЛЕНО
+    BYBIT_INSTRUMENTS_CACHE: str    # путь к SQLite-кэшу шагов инструментов ("" — выключен)
+    BYBIT_INSTRUMENTS_TTL_SEC: int
 
     # --- Monitor ---
     MONITOR_POLL_SEC: float
@@ -68,7 +71,8 @@ class Config:
 
     @property
     def TELEGRAM_ALLOWED_UPDATES(self) -> list[str]:
-        return ["message", "channel_post", "edited_channel_post"]
+        # релей работает только с постами канала-источника: остальные типы Telegram даже не присылает
+        return ["channel_post"]
 
 
 def _load_env() -> Config:
@@ -80,7 +84,8 @@ def _load_env() -> Config:
     dst = os.getenv("DEST_ID") or os.getenv("DEST_CHAT_ID") or os.getenv("DEST_CHANNEL_ID") or ""
     source_id = _to_int(src, 0)
     dest_id = _to_int(dst, 0)
-    poll_interval = _to_float(os.getenv("TELEGRAM_POLL_INTERVAL"), 1.5)
+    poll_interval = _to_float(os.getenv("TELEGRAM_POLL_INTERVAL"), 0.0)
+    poll_timeout = _to_int(os.getenv("TELEGRAM_POLL_TIMEOUT"), 30)
     drop_pending = _to_bool(os.getenv("TELEGRAM_DROP_PENDING"), True)
 
     # Logging
@@ -105,6 +110,8 @@ def _load_env() -> Config:
     bybit_time_resync = _to_int(os.getenv("BYBIT_TIME_RESYNC_SEC"), 60)
     bybit_switch_isolated = _to_bool(os.getenv("BYBIT_SWITCH_ISOLATED"), False)
     bybit_timeout_sec = _to_float(os.getenv("BYBIT_TIMEOUT_SEC"), 10.0)  # <— ДОБАВЛЕНО
+    bybit_inst_cache = (os.getenv("BYBIT_INSTRUMENTS_CACHE") or "").strip()  # по умолчанию выключен
+    bybit_inst_ttl = _to_int(os.getenv("BYBIT_INSTRUMENTS_TTL_SEC"), 86400)
 
     # Monitor
     monitor_poll = _to_float(os.getenv("MONITOR_POLL_SEC"), 2.0)
@@ -115,6 +122,7 @@ def _load_env() -> Config:
         SOURCE_ID=source_id,
         DEST_ID=dest_id,
         TELEGRAM_POLL_INTERVAL=poll_interval,
+        TELEGRAM_POLL_TIMEOUT=poll_timeout,
         TELEGRAM_DROP_PENDING=drop_pending,
         LOG_LEVEL=log_level,
         LOG_HTTP_VERBOSE=log_http,
@@ -133,6 +141,8 @@ def _load_env() -> Config:
         BYBIT_TIME_RESYNC_SEC=bybit_time_resync,
         BYBIT_SWITCH_ISOLATED=bybit_switch_isolated,
         BYBIT_TIMEOUT_SEC=bybit_timeout_sec,  # <— ДОБАВЛЕНО
+        BYBIT_INSTRUMENTS_CACHE=bybit_inst_cache,
+        BYBIT_INSTRUMENTS_TTL_SEC=bybit_inst_ttl,
         MONITOR_POLL_SEC=monitor_poll,
         MONITOR_TIMEOUT_SEC=monitor_timeout,
     )
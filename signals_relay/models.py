@@ -2,12 +2,12 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from enum import Enum
+from enum import IntEnum
 
 
-class Side(Enum):
-    LONG = "long"
-    SHORT = "short"
+class Side(IntEnum):
+    LONG = 0
+    SHORT = 1
 
 
 @dataclass(slots=True)
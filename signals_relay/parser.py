@@ -7,44 +7,76 @@ from .utils import normalize_number
 
 log = logging.getLogger(__name__)
 
-# позволяем пробелы и юникод-пробелы внутри числа: 112 043, 112 043, 1 234,56 и т.п.
-NUM = r"[0-9][0-9\s.,\u00A0\u2009\u202F]*"
-
-RE_SYMBOL = re.compile(r"\$?\s*([A-Z]{2,10}USDT)\b")
-RE_SIDE   = re.compile(r"\b(шорт|short|sell|лонг|long|buy)\b", re.IGNORECASE)
-RE_ENTRY  = re.compile(r"(?:вход|entry)\s*[-:–]\s*(" + NUM + ")", re.IGNORECASE)
-RE_STOP   = re.compile(r"(?:cтоп|стоп|stop|sl)\s*[-:–]\s*(" + NUM + ")", re.IGNORECASE)
-RE_TAKE   = re.compile(r"(?:тейк|take|tp)\s*[-:–]\s*(" + NUM + ")", re.IGNORECASE)
-RE_LEV    = re.compile(r"(?:плечо|lev|leverage)\s*[-:–]?\s*x?(\d+)", re.IGNORECASE)
+# юникод-пробелы (NBSP, THIN, NNBSP, табы и т.п.) заранее приводим к обычному пробелу,
+# поэтому класс числа чисто ASCII: 112 043, 1 234,56, 1.234,56 и т.п.
+_SPACE_TABLE = str.maketrans(dict.fromkeys(
+    "\t\x0b\x0c\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005"
+    "\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000",
+    " ",
+))
+NUM = r"[0-9][0-9 .,]*"
+
+# здесь остаётся stdlib re: в google-re2 \b только ASCII и не сработал бы на «шорт»/«лонг»
+# один сканер вместо шести отдельных проходов по тексту: каждая ветка — своя именованная группа
+RE_SIGNAL = re.compile(
+    r"(?-i:\$?\s*(?P<sym>[A-Z]{2,10}USDT)\b)"
+    r"|\b(?P<side>шорт|short|sell|лонг|long|buy)\b"
+    r"|(?:вход|entry)\s*[-:–]\s*(?P<en>" + NUM + ")"
+    r"|(?:cтоп|стоп|stop|sl)\s*[-:–]\s*(?P<st>" + NUM + ")"
+    r"|(?:тейк|take|tp)\s*[-:–]\s*(?P<tp>" + NUM + ")"
+    r"|(?:плечо|lev|leverage)\s*[-:–]?\s*x?(?P<lev>\d+)",
+    re.IGNORECASE,
+)
+_FIELDS = ("sym", "side", "en", "st", "tp", "lev")
+
+# обязательные ключевые слова (в нижнем регистре) — дешёвый отсев обычных сообщений до regex
+_KW_REQUIRED = (
+    ("usdt",),
+    ("шорт", "short", "sell", "лонг", "long", "buy"),
+    ("вход", "entry"),
+    ("cтоп", "стоп", "stop", "sl"),
+    ("тейк", "take", "tp"),
+)
+
+
+def _scan(t: str) -> dict[str, str]:
+    """Первое совпадение для каждого поля за один проход по строке."""
+    found: dict[str, str] = {}
+    for m in RE_SIGNAL.finditer(t):
+        key = m.lastgroup
+        if key not in found:
+            found[key] = m.group(key)
+            if len(found) == len(_FIELDS):
+                break
+    return found
 
 
 def parse_signal(text: str) -> Optional[TradeSignal]:
     if not text:
         return None
 
+    tl = text.lower()
+    if not all(any(k in tl for k in kws) for kws in _KW_REQUIRED):
+        return None
+
     # схлопнем переносы, лишние пробелы между блоками, но сами числовые пробелы допустимы
     t = " ".join(line.strip() for line in text.splitlines() if line.strip())
+    t = t.translate(_SPACE_TABLE)
 
-    m_sym = RE_SYMBOL.search(t)
-    m_side = RE_SIDE.search(t)
-    m_en = RE_ENTRY.search(t)
-    m_st = RE_STOP.search(t)
-    m_tp = RE_TAKE.search(t)
-
-    if not (m_sym and m_side and m_en and m_st and m_tp):
+    f = _scan(t)
+    if not ("sym" in f and "side" in f and "en" in f and "st" in f and "tp" in f):
         return None
 
-    symbol = m_sym.group(1).upper()
+    symbol = f["sym"].upper()
 
-    side_raw = m_side.group(1).lower()
+    side_raw = f["side"].lower()
     side = Side.SHORT if side_raw in {"шорт", "short", "sell"} else Side.LONG
 
-    entry = normalize_number(m_en.group(1))
-    stop  = normalize_number(m_st.group(1))
-    take  = normalize_number(m_tp.group(1))
+    entry = normalize_number(f["en"])
+    stop  = normalize_number(f["st"])
+    take  = normalize_number(f["tp"])
 
-    m_lev = RE_LEV.search(t)
-    lev = int(m_lev.group(1)) if m_lev else None
+    lev = int(f["lev"]) if "lev" in f else None
 
     return TradeSignal(symbol=symbol, side=side, entry=entry, stop=stop, take=take, leverage=lev)
 
@@ -1,120 +1,245 @@
 # signals_relay/telegram_app.py
 # signals_relay/telegram_app.py
+from __future__ import annotations
+
 import asyncio
 import logging
-from typing import Optional
-
-from telegram import Update
-from telegram.ext import Application, MessageHandler, ContextTypes, filters
-from telegram.request import HTTPXRequest
+import sys
+import time
+from typing import TYPE_CHECKING, Dict, Optional
 
 from .config import cfg
 from .logging_setup import setup_logging
 from .parser import parse_signal, pretty_signal
-from .broker.bybit import BybitBroker
-from .bus import TradingBus
+
+# тяжёлые модули (telegram.ext/httpx, aiohttp, брокер) импортируются лениво в post_init/run_app
+if TYPE_CHECKING:
+    import aiohttp
+    from telegram import Bot, Update
+    from telegram.ext import Application, ContextTypes
+
+    from .broker.bybit import BybitBroker
+    from .bus import TradingBus
 
 log = logging.getLogger(__name__)
 
 # Глобальные синглтоны на время жизни приложения
 _broker: Optional[BybitBroker] = None
 _bus: Optional[TradingBus] = None
+_http: Optional[aiohttp.ClientSession] = None
 
+# включён ли INFO для этого логгера — считается один раз после setup_logging,
+# чтобы на горячем пути при выключенном INFO не было даже вызова log.info
+_info: bool = True
 
-async def on_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    msg = update.effective_message
-    chat = update.effective_chat
-    if not msg or not chat:
-        return
+# ID чата назначения для горячего пути хендлеров (выставляется в run_app)
+_DEST_ID: int = 0
 
-    first = (msg.text or msg.caption or "").strip().splitlines()[0] if (msg.text or msg.caption) else ""
-    log.info("channel_post mid=%s first='%s'", msg.message_id, first[:30])
+# исходящие уведомления в DEST: копим ~20 мс и отправляем пачкой параллельно
+_SEND_BATCH_WINDOW_SEC = 0.02
+_SEND_BATCH_MAX = 10
+_send_q: Optional[asyncio.Queue] = None   # (chat_id, text, message_id) | None — стоп
+_SEND_FLUSH_TIMEOUT_SEC = 10.0             # сколько ждём дослать очередь при остановке
+_sender_task: Optional[asyncio.Task] = None
 
-    # фильтр по источнику
-    if chat.id != cfg.SOURCE_ID:
+# одинаковые ошибки (по типу) логируем не чаще раза в секунду
+_ERR_LOG_INTERVAL_SEC = 1.0
+_last_err: Dict[str, float] = {}
+
+
+async def on_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # сюда попадают только посты канала-источника (filters.Chat в run_app)
+    msg = update.effective_message
+    if not msg:
         return
 
-    # текст сообщения
+    # текст сообщения (берём один раз)
     text = msg.text or msg.caption or ""
+    if _info:
+        first = text.strip().partition("\n")[0]
+        log.info("channel_post mid=%s first='%s'", msg.message_id, first[:30])
+
     sig = parse_signal(text)
     if not sig:
-        log.info("[SKIP] not a trade signal (missing fields)")
+        if _info:
+            log.info("[SKIP] not a trade signal (missing fields)")
         return
 
-    # отправить нормализованный сигнал в DEST
-    pretty = pretty_signal(sig)
-    await context.bot.send_message(cfg.DEST_ID, pretty, disable_web_page_preview=True)
-    log.info("[OK] Sent normalized signal for post %s", msg.message_id)
+    # enqueue → трейдинг-воркер (сначала сделка: не ждём RTT до Telegram)
+    if _bus and not await _bus.enqueue(sig):
+        return  # дубль: сделки не будет — не дублируем и уведомление в DEST
 
-    # enqueue → трейдинг-воркер
-    if _bus:
-        await _bus.enqueue(sig)
+    # отправить нормализованный сигнал в DEST (через пакетный отправщик)
+    _send_q.put_nowait((_DEST_ID, pretty_signal(sig), msg.message_id))
 
 
-async def on_any_update(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-    # короткий диагностический лог: тип чата и первая строка текста
-    msg = update.effective_message
-    if not msg:
-        return
-    chat = msg.chat
-    text = (msg.text or msg.caption or "").strip()
-    first = text.splitlines()[0] if text else ""
-    log.info("update: chat=%s type=%s first='%s'", chat.id, chat.type, first[:40])
+async def _sender_loop(bot: Bot) -> None:
+    """Отправляет накопленные за короткое окно сообщения одним asyncio.gather; None в очереди — стоп."""
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await _send_q.get()
+        if item is None:
+            return
+        batch = [item]
+        stop = False
+        deadline = loop.time() + _SEND_BATCH_WINDOW_SEC
+        while len(batch) < _SEND_BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_send_q.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+
+        results = await asyncio.gather(
+            *(bot.send_message(chat_id, text, disable_web_page_preview=True) for chat_id, text, _ in batch),
+            return_exceptions=True,
+        )
+        for (_, _, mid), res in zip(batch, results):
+            if isinstance(res, Exception):
+                log.warning("[WARN] send normalized failed for post %s: %s", mid, res)
+            elif _info:
+                log.info("[OK] Sent normalized signal for post %s", mid)
+        if stop:
+            return
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-    log.warning("[ERR] %s: %s", type(context.error).__name__, context.error)
-    await asyncio.sleep(0.5)
+    key = type(context.error).__name__
+    now = time.monotonic()
+    if now - _last_err.get(key, float("-inf")) < _ERR_LOG_INTERVAL_SEC:
+        return
+    _last_err[key] = now
+    log.warning("[ERR] %s: %s", key, context.error)
 
 
 async def post_init(app: Application) -> None:
     """Этот хук вызывается уже внутри event loop PTB (v20), здесь инициализируем брокер/шину."""
-    global _broker, _bus
+    global _broker, _bus, _http, _send_q, _sender_task
+
+    import aiohttp
+
+    from .broker.bybit import BybitBroker
+    from .bus import TradingBus
+
+    # общая HTTP-сессия процесса: один пул соединений/DNS-кэш для исходящих REST-вызовов
+    _http = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=64, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=75),
+    )
+    app.bot_data["http"] = _http
 
     # брокер и шина
-    _broker = BybitBroker()           # логирует: Broker=Bybit v5 ready [...]
+    _broker = BybitBroker(session=_http)  # логирует: Broker=Bybit v5 ready [...]
     _bus = TradingBus(_broker)
     await _bus.start()                # стартуем воркер очереди в текущем loop
 
+    # отправщик уведомлений в DEST
+    _send_q = asyncio.Queue()
+    _sender_task = asyncio.create_task(_sender_loop(app.bot), name="dest-sender")
+
     me = await app.bot.get_me()
 
-    # Сброс вебхука
-    try:
-        await app.bot.delete_webhook(drop_pending_updates=True)
+    # сброс вебхука, тест записи в DEST и проверка ролей независимы — запускаем параллельно
+    webhook, dest_test, src_member, dest_member = await asyncio.gather(
+        app.bot.delete_webhook(drop_pending_updates=True),
+        app.bot.send_message(cfg.DEST_ID, "✅ Relay online (startup test)"),
+        app.bot.get_chat_member(cfg.SOURCE_ID, me.id),
+        app.bot.get_chat_member(cfg.DEST_ID, me.id),
+        return_exceptions=True,
+    )
+
+    if isinstance(webhook, Exception):
+        log.info("delete_webhook: %s", webhook)
+    else:
         log.info("Webhook cleared.")
-    except Exception as e:
-        log.info("delete_webhook: %s", e)
 
-    # Тест: можем ли писать в DEST
-    try:
-        await app.bot.send_message(cfg.DEST_ID, "✅ Relay online (startup test)")
+    if isinstance(dest_test, Exception):
+        log.error("✖ Cannot send to DEST (%s): %s", cfg.DEST_ID, dest_test)
+    else:
         log.info("Startup test message sent to DEST.")
-    except Exception as e:
-        log.error("✖ Cannot send to DEST (%s): %s", cfg.DEST_ID, e)
 
-    # Проверка ролей
-    try:
-        m = await app.bot.get_chat_member(cfg.SOURCE_ID, me.id)
-        log.info("Source role: %s", m.status)
-    except Exception as e:
-        log.error("✖ Не удалось проверить SOURCE: %s", e)
+    if isinstance(src_member, Exception):
+        log.error("✖ Не удалось проверить SOURCE: %s", src_member)
+    else:
+        log.info("Source role: %s", src_member.status)
+
+    if isinstance(dest_member, Exception):
+        log.error("✖ Не удалось проверить DEST: %s", dest_member)
+    else:
+        log.info("Dest role: %s", dest_member.status)
 
+    log.info("Application started")
+
+
+async def post_stop(app: Application) -> None:
+    """Досылаем уведомления из очереди, пока бот ещё не закрыт (post_shutdown — уже после bot.shutdown)."""
+    global _sender_task
+
+    if not _sender_task:
+        return
+    # стоп-маркер встаёт в конец очереди: всё, что уже в ней, отправится до выхода
+    _send_q.put_nowait(None)
     try:
-        m = await app.bot.get_chat_member(cfg.DEST_ID, me.id)
-        log.info("Dest role: %s", m.status)
+        await asyncio.wait_for(_sender_task, _SEND_FLUSH_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        dropped = 0
+        while not _send_q.empty():
+            dropped += _send_q.get_nowait() is not None
+        log.warning("[WARN] DEST flush timed out, %s queued notification(s) dropped", dropped)
     except Exception as e:
-        log.error("✖ Не удалось проверить DEST: %s", e)
+        log.warning("[WARN] DEST sender failed on shutdown: %s", e)
+    _sender_task = None
 
-    log.info("Application started")
+
+async def post_shutdown(app: Application) -> None:
+    """Останавливаем воркер шины, закрываем брокер и общую HTTP-сессию."""
+    global _broker, _bus, _http
+
+    if _bus:
+        await _bus.stop()
+        _bus = None
+    if _broker:
+        await _broker.aclose()
+        _broker = None
+    if _http:
+        await _http.close()
+        _http = None
+
+
+def _install_uvloop() -> None:
+    """uvloop (libuv) вместо стандартного loop — PTB подхватит политику в run_polling()."""
+    if sys.platform == "win32":
+        return
+    try:
+        import uvloop
+    except ImportError:
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
 def run_app() -> None:
     """Вариант для PTB v20: никакого asyncio.run — PTB сам запустит/закроет loop внутри run_polling()."""
+    global _DEST_ID, _info
+
+    from telegram.ext import Application, MessageHandler, filters
+    from telegram.request import HTTPXRequest
+
+    _DEST_ID = cfg.DEST_ID
+
+    _install_uvloop()
     setup_logging(cfg)
+    _info = log.isEnabledFor(logging.INFO)
     log.info("Relay running. Source: %s → Dest: %s", cfg.SOURCE_ID, cfg.DEST_ID)
 
-    # HTTPX таймауты для Telegram
+    # HTTPX для Telegram: HTTP/2 (мультиплексирование запросов в одном соединении) + таймауты
     request = HTTPXRequest(
+        http_version="2",
+        connection_pool_size=16,
         connect_timeout=15.0,
         read_timeout=60.0,
         write_timeout=60.0,
@@ -126,12 +251,16 @@ def run_app() -> None:
         .token(cfg.BOT_TOKEN)
         .request(request)
         .post_init(post_init)      # наш хук инициализирует брокер/шину и делает проверки
+        .post_stop(post_stop)      # досылает очередь уведомлений в DEST
+        .post_shutdown(post_shutdown)
         .build()
     )
 
     # хендлеры
-    app.add_handler(MessageHandler(filters.ALL, on_any_update), group=0)
-    app.add_handler(MessageHandler(filters.ChatType.CHANNEL, on_channel_post), group=1)
+    app.add_handler(
+        MessageHandler(filters.ChatType.CHANNEL & filters.Chat(chat_id=cfg.SOURCE_ID), on_channel_post),
+        group=1,
+    )
     app.add_error_handler(error_handler)
 
     # ВАЖНО: для v20 это синхронный вызов (блокирует поток) и сам управляет event loop
@@ -139,4 +268,5 @@ def run_app() -> None:
         allowed_updates=cfg.TELEGRAM_ALLOWED_UPDATES,
         drop_pending_updates=cfg.TELEGRAM_DROP_PENDING,
         poll_interval=cfg.TELEGRAM_POLL_INTERVAL,
+        timeout=cfg.TELEGRAM_POLL_TIMEOUT,   # long polling: сервер держит запрос до прихода апдейта
     )
@@ -1,9 +1,19 @@
 from __future__ import annotations
+
+import math
 import re
 
+try:
+    from fastnumbers import fast_float as _parse_float  # опционально: C-парсер чисел
+except ImportError:
+    _parse_float = float
+
 __all__ = ["normalize_number"]
 
-def normalize_number(text: str) -> float:
+_NON_NUM_RE = re.compile(r"[^0-9.\-]")
+_NUM_CHARS = frozenset("0123456789.-")
+
+def normalize_number(text: str | int | float) -> float:
     """
     Приводит строку-число к float, поддерживая и запятую, и точку, и любые пробелы/неразрывные пробелы:
     '2.123' → 2.123, '2,123' → 2.123, '1 234,56' → 1234.56,
@@ -12,9 +22,20 @@ def normalize_number(text: str) -> float:
     if text is None:
         raise ValueError("normalize_number: empty input")
 
-    t = str(text).strip()
-    # убрать все виды юникод-пробелов (включая NBSP/THIN/NNBSP и т.д.)
-    t = re.sub(r"\s+", "", t)
+    # уже число (bool сюда не попадает: type() строгий)
+    if type(text) in (int, float):
+        if not math.isfinite(text):
+            raise ValueError(f"normalize_number: bad numeric value: {text!r}")
+        return float(text)
+
+    # быстрый путь: уже каноничная запись (0.7321, 65432, -5) — сразу во float
+    is_str = type(text) is str
+    if is_str and text.isascii() and text.removeprefix("-").replace(".", "", 1).isdigit():
+        return _parse_float(text)
+
+    # пробелы (включая NBSP/THIN/NNBSP и т.д.) на выбор разделителя не влияют —
+    # их вместе с прочим мусором удаляет финальный фильтр символов
+    t = text if is_str else str(text)
 
     # Если есть и ',' и '.', определяем десятичный разделитель по последнему из них
     if "," in t and "." in t:
@@ -28,8 +49,10 @@ def normalize_number(text: str) -> float:
         # Только один разделитель: меняем запятую на точку
         t = t.replace(",", ".")
 
-    # Разрешаем только цифры, точку и минус
-    t = re.sub(r"[^0-9.\-]", "", t)
+    # Разрешаем только цифры, точку и минус — один проход удаляет и пробелы, и мусор
+    # (обычно строка уже чистая — тогда обходимся без regex-прохода)
+    if not _NUM_CHARS.issuperset(t):
+        t = _NON_NUM_RE.sub("", t)
 
     if t in {"", "-", ".", "-.", ".-"}:
         raise ValueError(f"normalize_number: bad numeric string: {text!r}")